@@ -101,9 +101,16 @@ function App() {
     const apiEndDate = endDate.replace(/-/g, '');
     try {
       const response = await axios.get('http://api.fireweatherindex.com:5000/api/station_data', { params: { station_id: stationId, start_date: apiStartDate, end_date: apiEndDate } });
-      if (response.data.length > 0) {
-        // Assign unique IDs to fetched rows
-        const fetchedRowsWithIds = response.data.map((row, index) => ({ ...row, id: `station-${index}-${Date.now()}` }));
+      const columns = response.data;
+      const rowCount = columns.date?.length || 0;
+      if (rowCount > 0) {
+        // The API returns one array per field; zip them into rows and assign unique IDs
+        const fields = Object.keys(columns);
+        const fetchedRowsWithIds = Array.from({ length: rowCount }, (_, index) => {
+          const row = { id: `station-${index}-${Date.now()}` };
+          fields.forEach(field => { row[field] = columns[field][index]; });
+          return row;
+        });
         setRows(fetchedRowsWithIds);
       } else {
         setErrorData("No data found for this station or date range.");
@@ -1,12 +1,32 @@
 
 
 import os
+
+# Give each web worker its share of the cores for BLAS/OpenMP threads. This has to happen before
+# NumPy is imported, otherwise every worker spins up one thread per core and they all contend.
+_WORKER_THREADS = str(max(1, (os.cpu_count() or 1) // max(1, int(os.getenv('WEB_CONCURRENCY', '1')))))
+for _thread_var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(_thread_var, _WORKER_THREADS)
+
+import asyncio
+import concurrent.futures
+import importlib.util
+import io
 import logging
+import operator
 import pickle
-import tensorflow as tf # <-- Import TensorFlow is necessary for Keras models
-from flask import Flask, request, jsonify
+import queue
+import threading
+import time
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import orjson
+import msgpack
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-import requests
+import httpx
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin, login_user, LoginManager, login_required, logout_user, current_user
 from flask_bcrypt import Bcrypt
@@ -16,29 +36,84 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # --- 1. SETUP ---
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, which encodes in C and handles NumPy arrays natively."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the decode in dumps()
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), mimetype="application/json")
+
 logging.basicConfig(level=logging.INFO)
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 # Allow local dev + the configured frontend origin
 CORS(app, origins=["http://fireweatherindex.com:5173", "http://localhost:5173"], supports_credentials=True)
 
+# One async HTTP client for all upstream APIs, running on its own event loop thread. Every Flask
+# worker thread hands its request to this loop, so all in-flight upstream calls share one
+# connection pool (multiplexed over HTTP/2 when the optional `h2` package is installed).
+UPSTREAM_RESULT_MARGIN_S = 5  # Extra wait on top of the httpx timeout before a worker gives up
+_upstream = {}  # pid -> (event loop, client); threads don't survive fork, so each process starts its own
+_upstream_lock = threading.Lock()
+
+def _get_upstream():
+    """Returns this process's (event loop, AsyncClient), starting the loop thread on first use."""
+    pid = os.getpid()
+    with _upstream_lock:
+        if pid not in _upstream:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="upstream-http", daemon=True).start()
+            client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(
+                    retries=3,
+                    http2=importlib.util.find_spec('h2') is not None,
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+                ),
+                timeout=15,
+                follow_redirects=True,  # Match requests' behaviour; upstream redirects are not errors
+            )
+            _upstream.clear()
+            _upstream[pid] = (loop, client)
+        return _upstream[pid]
+
+def _upstream_get(url, timeout):
+    """Runs a GET on the shared async client and blocks the calling worker until it completes."""
+    loop, client = _get_upstream()
+    future = asyncio.run_coroutine_threadsafe(client.get(url, timeout=timeout), loop)
+    try:
+        return future.result(timeout=timeout + UPSTREAM_RESULT_MARGIN_S)
+    except concurrent.futures.TimeoutError:
+        # The loop thread is stuck or gone; surface it like any other upstream timeout
+        future.cancel()
+        raise httpx.TimeoutException(f"No response from upstream within {timeout + UPSTREAM_RESULT_MARGIN_S}s")
+
 # --- Load NEW PINN Machine Learning Models ---
 try:
     base_dir = os.path.dirname(os.path.abspath(__file__))
     # **** Correct filenames for PINN ****
     scaler_path = os.path.join(base_dir, 'scaler_pinn.pkl')
-    model_path = os.path.join(base_dir, 'fwi_pinn_model.keras')
+    model_path = os.path.join(base_dir, 'fwi_pinn_weights.npz')  # Exported by train_pinn_model.py
 
     scaler = pickle.load(open(scaler_path, 'rb'))
-    pinn_model = tf.keras.models.load_model(model_path) # <-- Load the PINN model
-    app.logger.info("Successfully loaded scaler_pinn.pkl and fwi_pinn_model.keras.")
+    # StandardScaler.transform re-validates its input on every call; apply the same affine map directly
+    _scaler_mean = scaler.mean_.astype(np.float32)
+    _scaler_inv_scale = (1.0 / scaler.scale_).astype(np.float32)
+    # The PINN is a plain Dense(128, relu) -> Dense(64, relu) -> Dense(1) stack, so we keep
+    # just its weights and run the forward pass with NumPy instead of loading TensorFlow.
+    with np.load(model_path) as weights:
+        pinn_model = {name: np.ascontiguousarray(weights[name], dtype=np.float32)
+                      for name in ('W1', 'b1', 'W2', 'b2', 'W3', 'b3')} # <-- Load the PINN model
+    app.logger.info("Successfully loaded scaler_pinn.pkl and fwi_pinn_weights.npz.")
 except FileNotFoundError:
     scaler = None
     pinn_model = None # <-- Use correct variable name
-    app.logger.error("CRITICAL: Could not find scaler_pinn.pkl or fwi_pinn_model.keras. Prediction will fail.")
-except ImportError:
-    scaler = None
-    pinn_model = None
-    app.logger.error("TensorFlow not found or import error. Cannot load Keras model. Prediction will fail.")
+    app.logger.error("CRITICAL: Could not find scaler_pinn.pkl or fwi_pinn_weights.npz. Prediction will fail.")
 except Exception as e:
     scaler = None
     pinn_model = None # <-- Use correct variable name
@@ -49,19 +124,37 @@ except Exception as e:
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'default-dev-secret-key-for-testing')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///db.sqlite3')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Reuse pooled connections across requests; pre-ping drops connections the DB server has closed
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True, 'pool_recycle': 1800}
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # SQLite's in-memory pools reject sizing options, so only size the pool for server databases
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(pool_size=10, max_overflow=20)
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_SECURE'] = False
+# bcrypt cost factor; keep the default 12 in production, lower it only for dev/staging/load tests
+try:
+    bcrypt_rounds = int(os.getenv('BCRYPT_ROUNDS', '12'))
+except ValueError:
+    app.logger.warning(f"BCRYPT_ROUNDS={os.getenv('BCRYPT_ROUNDS')!r} is not an integer; using 12.")
+    bcrypt_rounds = 12
+if not 4 <= bcrypt_rounds <= 31:
+    # bcrypt only accepts 4-31 and would otherwise fail on the first hash, not at boot
+    app.logger.warning(f"BCRYPT_ROUNDS={bcrypt_rounds} is outside bcrypt's 4-31 range; clamping.")
+    bcrypt_rounds = min(max(bcrypt_rounds, 4), 31)
+app.config['BCRYPT_LOG_ROUNDS'] = bcrypt_rounds
 
 # --- 3. INITIALIZE EXTENSIONS & DB MODEL ---
 # (This section is the same as before)
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
+# Checked against on unknown emails so a miss costs the same bcrypt time as a wrong password
+_DUMMY_PASSWORD_HASH = bcrypt.generate_password_hash(os.urandom(16).hex()).decode('utf-8')
 login_manager = LoginManager(app)
 login_manager.session_protection = "strong"
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(100), unique=True, nullable=False)
+    email = db.Column(db.String(100), unique=True, index=True, nullable=False)  # Unique index ix_user_email
     password = db.Column(db.String(100), nullable=False)
 
 @login_manager.user_loader
@@ -90,8 +183,13 @@ def login():
     data = request.json or {}
     email, password = data.get('email'), data.get('password')
     if not all([email, password]): return jsonify({"error": "Email and password are required"}), 400
-    user = User.query.filter_by(email=email).first()
-    if user and bcrypt.check_password_hash(user.password, password):
+    # Fetch just the id and hash; a full User object is only loaded once the password checks out
+    row = db.session.execute(db.select(User.id, User.password).where(User.email == email)).first()
+    if not row:
+        bcrypt.check_password_hash(_DUMMY_PASSWORD_HASH, password)
+        return jsonify({"error": "Invalid email or password"}), 401
+    if bcrypt.check_password_hash(row.password, password):
+        user = db.session.get(User, row.id)
         login_user(user)
         return jsonify({"message": "Login successful", "user": {"email": user.email}}), 200
     return jsonify({"error": "Invalid email or password"}), 401
@@ -131,7 +229,7 @@ def get_weather():
             return jsonify({"error": "Server is missing the OpenWeatherMap API key."}), 500
 
         url = f"https://api.openweathermap.org/data/2.5/weather?lat={coords['lat']}&lon={coords['lon']}&appid={API_KEY}&units=metric"
-        response = requests.get(url, timeout=10)
+        response = _upstream_get(url, timeout=10)
         response.raise_for_status()
         data = response.json()
 
@@ -151,7 +249,7 @@ def get_weather():
             "rain": (rain_mm or 0) / 25.4
         }
         return jsonify(weather_data), 200
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         resp = getattr(e, "response", None)
         detail, status = None, 502
         try:
@@ -160,13 +258,93 @@ def get_weather():
             detail = resp.text if resp is not None else str(e)
         app.logger.error(f"HTTP Error from OpenWeatherMap: {detail}")
         return jsonify({"error": "Failed to fetch data from weather service.", "detail": detail}), status
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         app.logger.exception("Request to OpenWeatherMap failed")
         return jsonify({"error": "Could not connect to weather service.", "detail": str(e)}), 502
     except Exception as e:
         app.logger.exception("Unexpected error in get_weather")
         return jsonify({"error": f"An unexpected server error occurred: {e}"}), 500
 
+def _infer(batch):
+    """Runs the PINN forward pass on an (n, 8) float32 array, returning an (n, 1) array."""
+    h = np.maximum(0, batch @ pinn_model['W1'] + pinn_model['b1'])
+    h = np.maximum(0, h @ pinn_model['W2'] + pinn_model['b2'])
+    return h @ pinn_model['W3'] + pinn_model['b3']
+
+# --- Micro-batching: concurrent /api/predict calls are scored together in one forward pass ---
+PREDICT_MAX_BATCH_SIZE = 64
+PREDICT_BATCH_TIMEOUT_S = 0.005   # How long the worker waits for more requests to join a batch
+PREDICT_RESULT_TIMEOUT_S = 5      # How long a request waits for its batch before giving up
+_predict_queues = {}  # pid -> queue; the worker thread doesn't survive fork, so each process starts its own
+_predict_queues_lock = threading.Lock()
+
+def _batch_worker(predict_queue):
+    """Background loop: collects queued requests into a batch, scales and scores them, hands results back."""
+    while True:
+        pending = [predict_queue.get()]
+        deadline = time.monotonic() + PREDICT_BATCH_TIMEOUT_S
+        while len(pending) < PREDICT_MAX_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending.append(predict_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            # Scale the features exactly as the PINN's StandardScaler would
+            batch = np.array([features for features, _, _ in pending], dtype=np.float32)
+            scaled_features = (batch - _scaler_mean) * _scaler_inv_scale
+            # **** Make the prediction with your loaded PINN model ****
+            predictions = _infer(scaled_features)
+            for (_, done, result), value in zip(pending, predictions[:, 0]):
+                result['value'] = float(value)
+                done.set()
+        except Exception as e:
+            for _, done, result in pending:
+                result['error'] = e
+                done.set()
+
+def _get_predict_queue():
+    """Returns this process's request queue, starting its batch worker on first use."""
+    pid = os.getpid()
+    with _predict_queues_lock:
+        if pid not in _predict_queues:
+            predict_queue = queue.Queue()
+            threading.Thread(target=_batch_worker, args=(predict_queue,), name="pinn-batcher", daemon=True).start()
+            _predict_queues.clear()
+            _predict_queues[pid] = predict_queue
+        return _predict_queues[pid]
+
+def _batched_predict(features):
+    """Submits one feature tuple to the batch worker and blocks until its prediction is ready."""
+    done, result = threading.Event(), {}
+    _get_predict_queue().put((features, done, result))
+    if not done.wait(PREDICT_RESULT_TIMEOUT_S):
+        raise TimeoutError("Timed out waiting for the prediction batch")
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+if pinn_model and scaler:
+    # Warm-up: run both batch shapes once at boot so BLAS setup and first-touch of the weights
+    # happen before the first user request rather than during it
+    try:
+        for batch_size in (1, PREDICT_MAX_BATCH_SIZE):
+            _infer(np.zeros((batch_size, 8), dtype=np.float32))
+        app.logger.info("PINN warmed")
+    except Exception as e:
+        app.logger.error(f"PINN warm-up failed: {e}")
+
+@lru_cache(maxsize=4096)
+def _cached_predict(features):
+    """Scores one feature tuple; repeated weather inputs are served from the cache."""
+    return round(_batched_predict(features), 2)
+
+# The feature order must be EXACTLY what your model was trained on.
+FEATURE_ORDER = ('temperature', 'humidity', 'wind_speed', 'rain', 'ffmc', 'dmc', 'dc', 'isi')
+_get_features = operator.itemgetter(*FEATURE_ORDER)  # All eight fields in one C-level call
+
 # **** THIS IS THE PREDICTION FUNCTION USING THE PINN MODEL ****
 @app.route('/api/predict', methods=['POST'])
 @login_required
@@ -178,26 +356,22 @@ def predict():
 
     data = request.json or {}
     try:
-        # The feature order must be EXACTLY what your model was trained on.
-        features = [
-            float(data.get('temperature', 0)), float(data.get('humidity', 0)),
-            float(data.get('wind_speed', 0)), float(data.get('rain', 0)),
-            float(data.get('ffmc', 0)), float(data.get('dmc', 0)),
-            float(data.get('dc', 0)), float(data.get('isi', 0))
-        ]
-
-        # Scale the features using the PINN's scaler
-        scaled_features = scaler.transform([features])
-
-        # **** Make the prediction with your loaded PINN model ****
-        prediction = pinn_model.predict(scaled_features)
-
-        # The result is a 2D array, so we get the first item of the first item
-        fwi_value = round(float(prediction[0][0]), 2)
+        # Round before the cache lookup so near-identical readings share one entry
+        try:
+            values = _get_features(data)
+        except KeyError:
+            # Some fields are missing; those default to 0
+            values = tuple(data.get(key, 0) for key in FEATURE_ORDER)
+        features = tuple(round(float(value), 2) for value in values)
+        fwi_value = _cached_predict(features)
 
         # Return the real, PINN-powered prediction
         return jsonify({'fwi_prediction': fwi_value}), 200
 
+    except TimeoutError:
+        # The batch worker didn't answer in time: a server-side failure, not a bad request
+        app.logger.exception("Prediction timed out waiting for the batch worker")
+        return jsonify({"error": "Prediction service is busy, please retry."}), 503
     except Exception as e:
         app.logger.exception("An error occurred during prediction")
         return jsonify({"error": f"Prediction error: {e}"}), 400
@@ -213,16 +387,22 @@ def get_fires():
             app.logger.error("Missing NASA_API_KEY")
             return jsonify({"error": "Server missing NASA_API_KEY"}), 500
         url = f"https://firms.modaps.eosdis.nasa.gov/api/area/csv/{NASA_API_KEY}/VIIRS_SNPP_NRT/68,6,98,38/1"
-        response = requests.get(url, timeout=15)
+        response = _upstream_get(url, timeout=15)
         response.raise_for_status()
-        csv_lines, fires = response.text.splitlines(), []
-        if len(csv_lines) > 1:
-            header = csv_lines[0].split(',')
+        fires = []
+        if response.text.strip():
+            header = response.text.split('\n', 1)[0].strip().split(',')
             lat_idx, lon_idx = header.index('latitude'), header.index('longitude')
-            for line in csv_lines[1:]:
-                parts = line.split(',')
-                try: fires.append({"lat": float(parts[lat_idx]), "lon": float(parts[lon_idx])})
-                except (ValueError, IndexError): continue
+            try:
+                # Fast path: NumPy's C parser reads just the two coordinate columns
+                coords = np.loadtxt(io.StringIO(response.text), delimiter=',', skiprows=1, usecols=(lat_idx, lon_idx), ndmin=2).tolist()
+            except ValueError:
+                # Malformed rows: skip them as the old per-line loop did. Short rows and
+                # unparsable values come back as NaN from pandas and are dropped.
+                frame = pd.read_csv(io.StringIO(response.text), usecols=['latitude', 'longitude'], on_bad_lines='skip')
+                frame = frame.apply(pd.to_numeric, errors='coerce').dropna()
+                coords = zip(frame['latitude'].tolist(), frame['longitude'].tolist())
+            fires = [{"lat": lat, "lon": lon} for lat, lon in coords]
         return jsonify(fires), 200
     except Exception as e:
         app.logger.exception("Failed to fetch fire data")
@@ -245,23 +425,35 @@ def get_station_data():
         api_url = (f"https://api.synopticdata.com/v2/stations/timeseries?token={SYNOPTIC_API_KEY}&stid={station_id}"
                    f"&start={start_date}0000&end={end_date}2359&vars=air_temp,relative_humidity,wind_speed,precip_accum_one_hour"
                    f"&obtimezone=local&units=metric,mph,in")
-        response = requests.get(api_url, timeout=15)
+        response = _upstream_get(api_url, timeout=15)
         response.raise_for_status()
         data = response.json()
         if data.get('STATION'):
             obs = data['STATION'][0].get('OBSERVATIONS', {})
-            rows, dates = [], obs.get('date_time', [])
-            for i in range(len(dates)):
-                temp_c = obs.get('air_temp_set_1', [None] * len(dates))[i]
-                rows.append({
-                    "id": i + 1, "date": dates[i],
-                    "airTemp": (temp_c * 9/5 + 32) if temp_c is not None else None,
-                    "rh": obs.get('relative_humidity_set_1', [None] * len(dates))[i],
-                    "wind": obs.get('wind_speed_set_1', [None] * len(dates))[i],
-                    "precip": obs.get('precip_accum_one_hour_set_1', [None] * len(dates))[i],
-                    "init": "daily", "month": "N/A", "solar": None, "ffmc": 85, "dmc": 6, "dc": 15, "isi": 2, "bui": None, "fwi": None
-                })
-            return jsonify(rows), 200
+            dates = obs.get('date_time', [])
+            missing = [None] * len(dates)
+            # Pull each series once; missing readings become NaN so the C -> F conversion is one vectorized op
+            temp_c = np.array(obs.get('air_temp_set_1', missing), dtype=float)
+            air_temp = np.where(np.isnan(temp_c), None, temp_c * 9/5 + 32).tolist()
+            rh = obs.get('relative_humidity_set_1', missing)
+            wind = obs.get('wind_speed_set_1', missing)
+            precip = obs.get('precip_accum_one_hour_set_1', missing)
+            # Column-oriented payload (one list per field) instead of one dict per observation;
+            # the frontend zips the columns back into table rows.
+            n = len(dates)
+            payload = {
+                "date": dates, "airTemp": air_temp, "rh": rh, "wind": wind, "precip": precip,
+                "init": ["daily"] * n, "month": ["N/A"] * n, "solar": missing,
+                "ffmc": [85] * n, "dmc": [6] * n, "dc": [15] * n, "isi": [2] * n, "bui": missing, "fwi": missing
+            }
+            # Binary encoding for clients that prefer it; JSON stays the default for browsers
+            if request.accept_mimetypes.best_match(['application/json', 'application/msgpack']) == 'application/msgpack':
+                encoded = Response(msgpack.packb(payload, use_bin_type=True), mimetype='application/msgpack')
+            else:
+                encoded = jsonify(payload)
+            # Both encodings share this URL, so caches must key on Accept
+            encoded.vary.add('Accept')
+            return encoded, 200
         return jsonify({"error": "Station data not found or invalid ID"}), 404
     except Exception as e:
         app.logger.exception("An error occurred fetching station data")
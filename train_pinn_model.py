@@ -79,8 +79,13 @@ X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_
 scaler = StandardScaler()
 X_train_scaled = scaler.fit_transform(X_train)
 X_test_scaled = scaler.transform(X_test)
-train_dataset = tf.data.Dataset.from_tensor_slices((X_train_scaled, y_train)).shuffle(len(X_train)).batch(BATCH_SIZE)
-test_dataset = tf.data.Dataset.from_tensor_slices((X_test_scaled, y_test)).batch(BATCH_SIZE)
+# cache() keeps the sliced tensors resident across epochs; prefetch() overlaps batch prep with train_step
+train_dataset = (tf.data.Dataset.from_tensor_slices((X_train_scaled, y_train))
+                 .cache()
+                 .shuffle(len(X_train), reshuffle_each_iteration=True)
+                 .batch(BATCH_SIZE)
+                 .prefetch(tf.data.AUTOTUNE))
+test_dataset = tf.data.Dataset.from_tensor_slices((X_test_scaled, y_test)).cache().batch(BATCH_SIZE).prefetch(tf.data.AUTOTUNE)
 logging.info("Data split, scaled, and converted to TensorFlow datasets.")
 
 # --- 4. Build the Neural Network Model ---
@@ -95,33 +100,34 @@ model.summary()
 optimizer = tf.keras.optimizers.Adam()
 mse_loss_fn = tf.keras.losses.MeanSquaredError()
 
-def physics_loss_fn(model, x_batch):
-    with tf.GradientTape() as tape:
-        tape.watch(x_batch)
-        y_pred = model(x_batch, training=True)
-    gradients = tape.gradient(y_pred, x_batch)
-    if gradients is None: return tf.constant(0.0, dtype=tf.float32)
+# FWI should rise with Temperature and Ws and fall with RH and Rain. Multiplying each gradient by
+# its sign below turns every constraint violation into a positive value, so one relu covers all four.
+PHYSICS_GRAD_INDICES = [PHYSICS_FEATURES_INDICES[name] for name in ('Temperature', 'RH', 'Ws', 'Rain')]
+PHYSICS_GRAD_SIGNS = tf.constant([-1., 1., -1., 1.], dtype=tf.float32)
 
-    grad_temp = gradients[:, PHYSICS_FEATURES_INDICES['Temperature']]
-    grad_rh = gradients[:, PHYSICS_FEATURES_INDICES['RH']]
-    grad_ws = gradients[:, PHYSICS_FEATURES_INDICES['Ws']]
-    grad_rain = gradients[:, PHYSICS_FEATURES_INDICES['Rain']]
+def physics_loss_fn(gradients):
+    # gradients: d(FWI)/d(input features) for the batch, computed in train_step
+    if gradients is None: return tf.constant(0.0, dtype=tf.float32)
 
-    loss_temp = tf.reduce_mean(tf.maximum(0., -grad_temp))
-    loss_rh = tf.reduce_mean(tf.maximum(0., grad_rh))
-    loss_ws = tf.reduce_mean(tf.maximum(0., -grad_ws))
-    loss_rain = tf.reduce_mean(tf.maximum(0., grad_rain))
-    return loss_temp + loss_rh + loss_ws + loss_rain
+    violations = tf.nn.relu(tf.gather(gradients, PHYSICS_GRAD_INDICES, axis=1) * PHYSICS_GRAD_SIGNS)
+    # Sum of the four per-feature batch means == total violation / batch size
+    return tf.reduce_sum(violations) / tf.cast(tf.shape(gradients)[0], tf.float32)
 
 # --- 6. Custom Training Step ---
 @tf.function
 def train_step(x_batch, y_batch):
-    with tf.GradientTape() as tape:
+    # One persistent tape shares a single forward pass between the data and physics losses.
+    # The input gradients are taken inside the tape so the physics loss stays differentiable
+    # with respect to the weights.
+    with tf.GradientTape(persistent=True) as tape:
+        tape.watch(x_batch)
         y_pred = model(x_batch, training=True)
         data_loss = mse_loss_fn(y_batch, y_pred)
-        physics_loss = physics_loss_fn(model, x_batch)
+        input_gradients = tape.gradient(y_pred, x_batch)
+        physics_loss = physics_loss_fn(input_gradients)
         total_loss = data_loss + PHYSICS_LOSS_WEIGHT * physics_loss
     gradients = tape.gradient(total_loss, model.trainable_variables)
+    del tape
     optimizer.apply_gradients(zip(gradients, model.trainable_variables))
     return data_loss, physics_loss, total_loss
 
@@ -151,9 +157,11 @@ print("-------------------------------------\n")
 # --- 9. Save the Trained Model and Scaler ---
 scaler_filename = 'scaler_pinn.pkl'
 model_filename = 'fwi_pinn_model.keras'
+weights_filename = 'fwi_pinn_weights.npz'
 base_dir = os.path.dirname(os.path.abspath(__file__))
 scaler_path = os.path.join(base_dir, scaler_filename)
 model_path = os.path.join(base_dir, model_filename)
+weights_path = os.path.join(base_dir, weights_filename)
 
 with open(scaler_path, 'wb') as f:
     pickle.dump(scaler, f)
@@ -161,4 +169,9 @@ logging.info(f"Scaler saved to: {scaler_path}")
 
 model.save(model_path)
 logging.info(f"PINN model saved to: {model_path}")
+
+# app.py runs the forward pass in plain NumPy, so it only needs the raw Dense weights
+(W1, b1), (W2, b2), (W3, b3) = (layer.get_weights() for layer in model.layers)
+np.savez(weights_path, W1=W1, b1=b1, W2=W2, b2=b2, W3=W3, b3=b3)
+logging.info(f"PINN weights saved to: {weights_path}")
 print("\n--- All files saved successfully! You can now run app.py again. ---\n")